@@ -1,4 +1,4 @@
-from typing import Optional, Set
+from typing import Optional, Tuple
 
 from ..schemas.api import (
     CreateChatCompletionRequest,
@@ -10,8 +10,8 @@ logger = ApiLogger(__name__)
 
 
 class PromptUtilsMixin:
-    _stop_set: Optional[Set[str]] = None
-    _stop_piece_set: Optional[Set[str]] = None
+    _stops: Tuple[str, ...] = ()
+    _stop_pieces: Tuple[str, ...] = ()
     _role_formats_and_stops = (
         {}
     )  # type: dict[str, tuple[dict[str, str], set[str]]]
@@ -152,25 +152,26 @@ class PromptUtilsMixin:
             stops = settings.stop
         else:
             stops = []
-        self._stop_set = set(stops)
-        self._stop_piece_set = {
-            stop[:prefix_idx]
-            for stop in stops
-            for prefix_idx in range(1, len(stop))
-        }
+        self._stops = tuple(set(stops))
+        self._stop_pieces = tuple(
+            {
+                stop[:prefix_idx]
+                for stop in stops
+                for prefix_idx in range(1, len(stop))
+            }
+        )
 
     def stop_checker(self, text_piece: str) -> Optional[bool]:
         """Optimized stop checker for text completion.
         Returns False if the text piece ends with any piece of stop.
         Returns True if the text piece contains any stop.
         Returns None if the text piece does not contain any piece of stop."""
-        if any(
-            text_piece.endswith(stop_piece)
-            for stop_piece in self._stop_piece_set or ()
-        ):
+        # `str.endswith` checks all the pieces of stops in a single call
+        if text_piece.endswith(self._stop_pieces):
             return False
-        if any(stop in text_piece for stop in self._stop_set or ()):
-            return True
+        for stop in self._stops:
+            if stop in text_piece:
+                return True
         return None
 
     @staticmethod
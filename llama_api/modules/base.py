@@ -121,9 +121,13 @@ class BaseCompletionGenerator(
 
     @abstractmethod
     def generate_text(
-        self, prompt: str, settings: TextGenerationSettings
+        self,
+        prompt: str,
+        settings: TextGenerationSettings,
+        input_ids: Optional[List[int]] = None,
     ) -> Iterator[str]:
-        ...
+        """Generate text from the prompt. `input_ids` is the prompt
+        already tokenized by `encode`, if the generator can use it."""
 
     @property
     def model_name(self) -> str:
@@ -300,17 +304,21 @@ class BaseCompletionGenerator(
             prompt = request.prompt
 
         # Build the settings for generating the text
-        self.build_max_tokens_from_settings(request, prompt)
+        prompt_ids = self.encode(prompt)
+        self.build_max_tokens_from_settings(request, prompt, prompt_ids)
         self.build_stops_from_settings(request)
-        return self.generate_text(prompt, request)
+        return self.generate_text(prompt, request, prompt_ids)
 
     def build_max_tokens_from_settings(
         self,
         request: Union[CreateChatCompletionRequest, CreateCompletionRequest],
         prompt: str,
+        prompt_ids: Optional[List[int]] = None,
     ) -> int:
-        """Build the max_tokens parameter for generating the text."""
-        prompt_ids = self.encode(prompt)
+        """Build the max_tokens parameter for generating the text.
+        `prompt_ids` is the encoded prompt, if it's already encoded."""
+        if prompt_ids is None:
+            prompt_ids = self.encode(prompt)
         prompt_tokens = len(prompt_ids)
         context_window = self.llm_model.max_total_tokens
         if request.max_tokens is None:
@@ -139,8 +139,13 @@ class ExllamaCompletionGenerator(BaseCompletionGenerator):
         self.destruct_model(logger, pytorch=True)
 
     def generate_text(
-        self, prompt: str, settings: TextGenerationSettings
+        self,
+        prompt: str,
+        settings: TextGenerationSettings,
+        input_ids: Optional[List[int]] = None,
     ) -> Iterator[str]:
+        # The prompt is encoded into a tensor with the mask here,
+        # so `input_ids` is not used
         with logger.log_any_error():
             # Encode the prompt
             if settings.guidance_scale == 1:
@@ -6,7 +6,7 @@ from pathlib import Path
 
 from random import random
 from re import compile
-from typing import Iterator, List
+from typing import Iterator, List, Optional
 
 from torch import IntTensor, cat, cuda
 
@@ -97,8 +97,12 @@ class ExllamaV2CompletionGenerator(BaseCompletionGenerator):
         self.destruct_model(logger, pytorch=True)
 
     def generate_text(
-        self, prompt: str, settings: TextGenerationSettings
+        self,
+        prompt: str,
+        settings: TextGenerationSettings,
+        input_ids: Optional[List[int]] = None,
     ) -> Iterator[str]:
+        # The prompt is encoded into a tensor here, so `input_ids` is not used
         with logger.log_any_error():
             # Set up the variables
             IdToPiece = self.tokenizer.tokenizer.IdToPiece
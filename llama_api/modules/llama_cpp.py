@@ -1,10 +1,13 @@
 """Wrapper for llama_cpp to generate text completions."""
 # flake8: noqa
-from concurrent.futures import ThreadPoolExecutor
-import sys
+from codecs import getincrementaldecoder
+import os
 from array import array
 from inspect import signature
-from typing import Iterator, List, Optional, Union
+from threading import Thread
+from typing import Any, Dict, Iterator, List, Optional, Union
+
+import numpy as np
 
 from ..mixins.completion import CompletionStatus
 from ..schemas.api import (
@@ -26,6 +29,11 @@ with import_repository(**Config.repositories["llama_cpp"]):
     build_shared_lib(logger=logger)
     from repositories.llama_cpp import llama_cpp
 
+# Parameters accepted by the installed version of llama-cpp-python
+_LLAMA_INIT_PARAMS = frozenset(signature(llama_cpp.Llama.__init__).parameters)
+_LLAMA_GENERATE_PARAMS = frozenset(
+    signature(llama_cpp.Llama.generate).parameters
+)
 StoppingCriteriaList = llama_cpp.StoppingCriteriaList
 LogitsProcessorList = llama_cpp.LogitsProcessorList
 
@@ -48,21 +56,23 @@ class LlamaCppCompletionGenerator(BaseCompletionGenerator):
     def from_pretrained(
         cls, llm_model: "LlamaCppModel"
     ) -> "LlamaCppCompletionGenerator":
+        # Start reading the weights into the page cache in the background,
+        # while the arguments for the llama.cpp client are being prepared
+        model_path = llm_model.model_path_resolved
+        Thread(
+            target=_prefetch_model_file, args=(model_path,), daemon=True
+        ).start()
         kwargs = {
             # Get all attributes of llm_model
             key: value
             for key, value in llm_model.asdict.items()
-            # Hacky way to pass arguments to older versions of llama-cpp-python
-            if key in signature(llama_cpp.Llama.__init__).parameters.keys()
+            if key in _LLAMA_INIT_PARAMS
         }
         kwargs["n_ctx"] = llm_model.max_total_tokens
-        kwargs["model_path"] = llm_model.model_path_resolved
+        kwargs["model_path"] = model_path
         kwargs["verbose"] = llm_model.verbose and llm_model.echo
         try:
-            with ThreadPoolExecutor(max_workers=1) as executor:
-                client = executor.submit(llama_cpp.Llama, **kwargs).result(
-                    timeout=60
-                )
+            client = _create_llama_with_timeout(timeout=60, **kwargs)
         except AssertionError:
             raise MemoryError(
                 "Failed to initialize llama.cpp model. "
@@ -93,6 +103,8 @@ class LlamaCppCompletionGenerator(BaseCompletionGenerator):
                     )
                 cache = llama_cpp.LlamaRAMCache(capacity_bytes=cache_size)
             client.set_cache(cache)
+        # n_ctx can't be changed after the client is initialized
+        llm_model.max_total_tokens = client.n_ctx()
         self = cls(llm_model)
         self.client = client
         return self
@@ -108,19 +120,23 @@ class LlamaCppCompletionGenerator(BaseCompletionGenerator):
         return self.client.detokenize(ids).decode("utf-8", errors="ignore")
 
     def generate_text(
-        self, prompt: str, settings: TextGenerationSettings
+        self,
+        prompt: str,
+        settings: TextGenerationSettings,
+        input_ids: Optional[List[int]] = None,
     ) -> Iterator[str]:
+        """Generate text from the prompt. If `input_ids` is given,
+        it is used as the already tokenized prompt."""
         client = self.client
         assert client is not None, "Llama is not initialized"
-        self.llm_model.max_total_tokens = client.n_ctx()
         assert client.ctx is not None, "Llama context is not initialized"
-        input_ids = array(
-            "i",
-            client.tokenize(prompt.encode("utf-8"))
-            if prompt != ""
-            else [client.token_bos()],
-        )  # type: array[int]
-        yield from self._generate_text(client, input_ids, settings)
+        if prompt == "":
+            input_ids = [client.token_bos()]
+        elif input_ids is None:
+            input_ids = self.encode(prompt)
+        yield from self._generate_text(
+            client, array("i", input_ids), settings
+        )
 
     def _generate_text(
         self,
@@ -155,8 +171,11 @@ class LlamaCppCompletionGenerator(BaseCompletionGenerator):
             else None
         )
         detokenize = client.detokenize
-        generated_ids = array("i")  # type: array[int]
-        byte_array = bytearray()  # type: bytearray
+        check_interruption = self.check_interruption
+        stop_checker = self.stop_checker
+        # Multi-byte characters may be split across several tokens, so
+        # the decoder keeps the partial bytes until they can be decoded.
+        decode = getincrementaldecoder("utf-8")(errors="ignore").decode
         eos_token_id = client.token_eos()
         logprobs = settings.logprobs
         text_buffer = ""  # type: str
@@ -172,49 +191,45 @@ class LlamaCppCompletionGenerator(BaseCompletionGenerator):
         if self.check_interruption(completion_status):
             return
         assert settings.max_tokens is not None, "max_tokens must be set"
+        # Preallocate the prompt ids followed by the generated ids,
+        # since max_tokens bounds the loop
+        n_tokens = len(input_ids)
+        token_ids = input_ids + array("i", [0]) * settings.max_tokens
+        generate_kwargs = {
+            "temp": settings.temperature
+        }  # type: Dict[str, Any]
+        for key, value in (
+            ("stopping_criteria", stopping_criteria),
+            ("logits_processor", logit_processors),
+            ("grammar", grammar),
+        ):
+            # Hacky way to pass arguments to older versions of llama-cpp-python
+            if value is not None and key in _LLAMA_GENERATE_PARAMS:
+                generate_kwargs[key] = value
         for _, token_id in zip(
             range(settings.max_tokens),
-            client.generate(
-                input_ids,
-                **{
-                    key: value
-                    for key, value in {
-                        **self.llm_model.asdict,
-                        **{
-                            "temp": settings.temperature,
-                            "stopping_criteria": stopping_criteria,
-                            "logits_processor": logit_processors,
-                            "grammar": grammar,
-                        },
-                    }.items()
-                    # Hacky way to pass arguments safely to older versions of llama-cpp-python
-                    if key in signature(client.generate).parameters.keys()
-                },
-            ),
+            client.generate(input_ids, **generate_kwargs),
         ):
             # Check if the token is a stop token
             if (
-                self.check_interruption(completion_status)
+                check_interruption(completion_status)
                 or token_id == eos_token_id
             ):
                 break
 
             # Update the generated id
-            generated_ids.append(token_id)
+            token_ids[n_tokens] = token_id
+            n_tokens += 1
             completion_status.generated_tokens += 1
 
-            piece = detokenize([token_id])  # type: bytes
-            try:
-                # Try to decode the token
-                text_to_yield = text_buffer + (byte_array + piece).decode()
-                byte_array.clear()
-            except UnicodeDecodeError:
-                # Multi-byte characters are not decoded correctly if partial
-                byte_array.extend(piece)
+            decoded = decode(detokenize([token_id]))  # type: str
+            if not decoded:
+                # The token is a part of a multi-byte character
                 continue
+            text_to_yield = text_buffer + decoded
 
             # Check if the decoded text contains any of the stop tokens.
-            stop_status = self.stop_checker(text_to_yield)
+            stop_status = stop_checker(text_to_yield)
             if stop_status is None:  # Good to go
                 text_buffer = ""  # Clear the buffer
                 completion_status.generated_text += text_to_yield
@@ -229,12 +244,63 @@ class LlamaCppCompletionGenerator(BaseCompletionGenerator):
             llama_cpp.llama_print_timings(ctx)
         if client.cache:
             if verbose:
-                print(
-                    "Llama._create_completion: cache save", file=sys.stderr
-                )
-            client.cache[input_ids + generated_ids] = client.save_state()
-            print("Llama._create_completion: cache saved", file=sys.stderr)
+                logger.info("🦙 Saving the llama.cpp cache...")
+            # The cache converts the key into a tuple by itself,
+            # so a view of the buffer is enough as the key
+            client.cache[
+                memoryview(token_ids)[:n_tokens]
+            ] = client.save_state()
+            if verbose:
+                logger.info("🦙 Saved the llama.cpp cache")
+        return
+
+
+def _prefetch_model_file(model_path: str) -> None:
+    """Advise the OS to read the model file into the page cache ahead,
+    so that the weights are already hot when llama.cpp maps them.
+    This is a no-op on platforms without `posix_fadvise`."""
+    if not hasattr(os, "posix_fadvise"):
+        return
+    try:
+        fd = os.open(model_path, os.O_RDONLY)
+    except OSError:
         return
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _create_llama_with_timeout(
+    timeout: float, **kwargs: Any
+) -> llama_cpp.Llama:
+    """Initialize the llama.cpp client in a daemon thread,
+    and raise TimeoutError if it takes longer than `timeout` seconds.
+    On timeout, the load is still waited for and its client is dropped,
+    so that two loads never hold the memory at the same time."""
+    clients = []  # type: List[llama_cpp.Llama]
+    errors = []  # type: List[BaseException]
+
+    def init_llama() -> None:
+        try:
+            clients.append(llama_cpp.Llama(**kwargs))
+        except BaseException as e:
+            errors.append(e)
+
+    thread = Thread(target=init_llama, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    if thread.is_alive():
+        thread.join()
+        clients.clear()  # Free the late client before the next load
+        raise TimeoutError(
+            f"Failed to initialize llama.cpp model in {timeout} seconds"
+        )
+    if errors:
+        raise errors[0]
+    return clients[0]
 
 
 def _load_cache(
@@ -244,22 +310,28 @@ def _load_cache(
 ) -> None:
     try:
         cache_item = cache[ids]
-        cache_prefix_len = client.longest_token_prefix(
-            cache_item.input_ids.tolist(), ids
+        input_ids = np.frombuffer(ids, dtype=np.intc)
+        cache_prefix_len = _longest_token_prefix(
+            np.asarray(cache_item.input_ids), input_ids
         )
-        eval_prefix_len = client.longest_token_prefix(
-            client._input_ids.tolist(), ids
+        eval_prefix_len = _longest_token_prefix(
+            np.asarray(client._input_ids), input_ids
         )
         if cache_prefix_len > eval_prefix_len:
             client.load_state(cache_item)
             if client.verbose:
-                print(
-                    "Llama._create_completion: cache hit",
-                    file=sys.stderr,
-                )
+                logger.info("🦙 llama.cpp cache hit")
     except KeyError:
         if client.verbose:
-            print("Llama._create_completion: cache miss", file=sys.stderr)
+            logger.info("🦙 llama.cpp cache miss")
+
+
+def _longest_token_prefix(a: np.ndarray, b: np.ndarray) -> int:
+    """Get the length of the common prefix of two token arrays,
+    without converting them into python lists."""
+    length = min(a.size, b.size)
+    mismatches = np.flatnonzero(a[:length] != b[:length])
+    return int(mismatches[0]) if mismatches.size else length
 
 
 def _get_log_probs(
@@ -272,37 +344,40 @@ def _get_log_probs(
     token: int,
 ) -> CompletionLogprobs:
     assert client.ctx is not None, "Llama context is not initialized"
-    token_str = client.detokenize([token]).decode("utf-8", errors="ignore")
+    detokenize = client.detokenize
+    token = int(token)
+    token_str = detokenize([token]).decode("utf-8", errors="ignore")
     text_offset = len(completion_status.input_text) + len(
         completion_status.generated_text
     )
     token_offset = prompt_tokens + generated_tokens
-    current_logprobs = client.logits_to_logprobs(
-        client.scores[: client.n_tokens, :][token_offset - 1, :].tolist()
+    # Index the row directly; `token_offset - 1` is always < n_tokens
+    current_logits = np.asarray(
+        client.scores[token_offset - 1, :], dtype=np.single
     )
+    # Log-softmax in float32, shifting by the max logit for stability
+    current_logprobs = current_logits - current_logits.max()
+    current_logprobs -= np.log(np.exp(current_logprobs).sum())
+
+    # Select the top-k logprobs without sorting the whole vocabulary
+    top_k = min(logprobs, current_logprobs.size)
+    top_ids = np.argpartition(-current_logprobs, top_k - 1)[:top_k]
+    top_ids = top_ids[np.argsort(-current_logprobs[top_ids])]
+    token_logprob = float(current_logprobs[token])
+
+    # Detokenize each candidate once, reusing the selected token's string
+    top_logprobs = {}  # type: Dict[str, float]
+    for top_id in top_ids.tolist():
+        top_str = (
+            token_str
+            if top_id == token
+            else detokenize([top_id]).decode("utf-8", errors="ignore")
+        )
+        top_logprobs[top_str] = float(current_logprobs[top_id])
+    top_logprobs[token_str] = token_logprob
     return {
-        "tokens": [
-            client.detokenize([token]).decode("utf-8", errors="ignore")
-        ],
+        "tokens": [token_str],
         "text_offset": [text_offset],
-        "token_logprobs": [current_logprobs[int(token)]],
-        "top_logprobs": [
-            {
-                **{
-                    client.detokenize([i]).decode(
-                        "utf-8", errors="ignore"
-                    ): logprob
-                    for logprob, i in list(
-                        sorted(
-                            zip(
-                                current_logprobs,
-                                range(len(current_logprobs)),
-                            ),
-                            reverse=True,
-                        )
-                    )[:logprobs]
-                },
-                token_str: current_logprobs[int(token)],
-            }
-        ],
+        "token_logprobs": [token_logprob],
+        "top_logprobs": [top_logprobs],
     }
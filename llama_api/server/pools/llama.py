@@ -1,4 +1,5 @@
-from collections import deque
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 from dataclasses import dataclass, field
 from datetime import date
@@ -6,11 +7,12 @@ from multiprocessing import current_process
 from os import getpid
 from queue import Queue
 from threading import Event
-from time import time
+from time import monotonic, time
 from typing import Literal  # noqa: F401
-from typing import Deque, Iterator, List, Optional, Union
+from typing import Any, Dict, Iterator, List, Optional, Union
 
-from orjson import OPT_INDENT_2, dumps
+from orjson import Fragment, dumps
+from pydantic import TypeAdapter
 
 from ...mixins.completion import CompletionStatus
 from ...modules.base import (
@@ -19,6 +21,7 @@ from ...modules.base import (
     BaseLLMModel,
 )
 from ...schemas.api import (
+    APIChatMessage,
     ChatCompletion,
     ChatCompletionChunk,
     Completion,
@@ -31,12 +34,15 @@ from ...schemas.api import (
     EmbeddingUsage,
 )
 from ...schemas.models import ExllamaModel, LlamaCppModel
+from ...shared.config import MainCliArgs
 from ...utils.concurrency import queue_manager
 from ...utils.lazy_imports import LazyImports
 from ...utils.logger import ApiLogger, LoggingConfig
 from ...utils.model_definition_finder import ModelDefinitions
 from ...utils.system_utils import free_memory_of_first_item_from_container
 
+STREAM_FLUSH_INTERVAL = 0.05  # seconds to coalesce the streamed chunks
+
 logger = ApiLogger(__name__)
 logger.info(f"🔧 {current_process()} is initiated with PID: {getpid()}")
 chat_logger = ApiLogger(
@@ -47,9 +53,22 @@ chat_logger = ApiLogger(
         color=False,
     ),
 )
+# Chat logs are written in the background, off the request path
+chat_log_executor = ThreadPoolExecutor(max_workers=1)
 lazy = LazyImports()  # lazy-loader of modules
-completion_generators: Deque["BaseCompletionGenerator"] = deque(maxlen=1)
-embedding_generators: Deque["BaseEmbeddingGenerator"] = deque(maxlen=1)
+# LRU caches of generators, ordered from the least recently used one
+completion_generators = (
+    OrderedDict()
+)  # type: OrderedDict[str, BaseCompletionGenerator]
+embedding_generators = (
+    OrderedDict()
+)  # type: OrderedDict[str, BaseEmbeddingGenerator]
+chat_messages_adapter = TypeAdapter(List[APIChatMessage])
+
+
+def _max_cached_models() -> int:
+    """Get the maximum number of generators to keep per cache"""
+    return max(MainCliArgs.max_cached_models.value or 1, 1)
 
 
 @dataclass
@@ -73,28 +92,21 @@ def handle_exception():
         raise e
 
 
-@contextmanager
-def completion_generator_manager(
-    body: Union[CreateCompletionRequest, CreateChatCompletionRequest],
-    llm_model: BaseLLMModel,
-    interrupt_signal: Event,
-):
-    """Context manager for completion generators."""
-    with handle_exception():
-        cg = None  # To avoid UnboundLocalError
-        try:
-            cg = get_completion_generator(llm_model)
-            cg.interrupt_signal = interrupt_signal
-            cg.acquire_lock()
-            yield cg
-            log_request_and_response(
-                body,
-                cg.completion_status[body.completion_id],
-            )
-        finally:
-            if cg is not None:
-                cg.release_lock()
-                cg.interrupt_signal = None
+def _acquire_completion_generator(
+    llm_model: BaseLLMModel, interrupt_signal: Event
+) -> BaseCompletionGenerator:
+    """Get the completion generator for the model, and lock it
+    for the request with the given interrupt signal."""
+    cg = get_completion_generator(llm_model)
+    cg.acquire_lock()
+    cg.interrupt_signal = interrupt_signal
+    return cg
+
+
+def _release_completion_generator(cg: BaseCompletionGenerator) -> None:
+    """Unlock the completion generator for the next request."""
+    cg.interrupt_signal = None
+    cg.release_lock()
 
 
 def get_completion_generator(
@@ -111,12 +123,10 @@ def get_completion_generator(
         # Check if the model is defined in LLMModels enum
 
         # Check if the model is cached. If so, return the cached one.
-        for completion_generator in completion_generators:
-            if (
-                completion_generator.llm_model.model_path
-                == llm_model.model_path
-            ):
-                return completion_generator
+        key = llm_model.model_path
+        if key in completion_generators:
+            completion_generators.move_to_end(key)
+            return completion_generators[key]
 
         # Before creating new one, deallocate embeddings to free up memory
         if embedding_generators:
@@ -125,7 +135,7 @@ def get_completion_generator(
             )
 
         # Before creating a new completion generator, check memory usage
-        if completion_generators.maxlen == len(completion_generators):
+        if len(completion_generators) >= _max_cached_models():
             free_memory_of_first_item_from_container(
                 completion_generators, logger=logger
             )
@@ -146,10 +156,10 @@ def get_completion_generator(
             raise NotImplementedError(
                 f"Model {llm_model.model_path} not implemented"
             )
-        # Add the new completion generator to the deque cache
+        # Add the new completion generator to the LRU cache
         assert not isinstance(cg, Exception), cg
         to_return = cg.from_pretrained(llm_model)  # type: ignore
-        completion_generators.append(to_return)
+        completion_generators[key] = to_return
         return to_return
 
 
@@ -163,13 +173,13 @@ def get_embedding_generator(
     with logger.log_any_error(
         f"Error getting a embedding generator of {body.model}"
     ):
-        body.model = body.model.lower()
-        for embedding_generator in embedding_generators:
-            if embedding_generator.model_name == body.model:
-                return embedding_generator
+        body.model = key = body.model.lower()
+        if key in embedding_generators:
+            embedding_generators.move_to_end(key)
+            return embedding_generators[key]
 
         # Before creating a new completion generator, check memory usage
-        if embedding_generators.maxlen == len(embedding_generators):
+        if len(embedding_generators) >= _max_cached_models():
             free_memory_of_first_item_from_container(
                 embedding_generators, logger=logger
             )
@@ -198,8 +208,8 @@ def get_embedding_generator(
                 body.model
             )
 
-        # Add the new completion generator to the deque cache
-        embedding_generators.append(to_return)
+        # Add the new embedding generator to the LRU cache
+        embedding_generators[key] = to_return
         return to_return
 
 
@@ -209,32 +219,81 @@ def generate_completion_chunks(
     queue: Queue,
     interrupt_signal: Event,
 ) -> None:
-    with queue_manager(queue=queue):
-        with completion_generator_manager(
-            body, llm_model, interrupt_signal
-        ) as cg:
+    with queue_manager(queue=queue), handle_exception():
+        cg = _acquire_completion_generator(llm_model, interrupt_signal)
+        try:
             if isinstance(body, CreateChatCompletionRequest):
                 _iterator: Iterator[
                     Union[ChatCompletionChunk, CompletionChunk]
                 ] = cg.generate_chat_completion_with_streaming(body)
             elif isinstance(body, CreateCompletionRequest):
                 _iterator = cg.generate_completion_with_streaming(body)
-            first_response: Union[
-                ChatCompletionChunk, CompletionChunk
-            ] = next(_iterator)
-
-            def iterator() -> (
-                Iterator[Union[ChatCompletionChunk, CompletionChunk]]
-            ):
-                yield first_response
-                for chunk in _iterator:
-                    yield chunk
-
-            for chunk in iterator():
+
+            # Coalesce the text chunks generated within the flush interval,
+            # to reduce the number of IPC round trips per token
+            pending = None  # type: Optional[Dict[str, Any]]
+            flushed_at = 0.0
+            for chunk in _iterator:
+                if pending is None or not _merge_chunk_text(pending, chunk):
+                    if pending is not None:
+                        queue.put(pending)
+                    pending = _copy_chunk(chunk)
                 if interrupt_signal.is_set():
-                    # If the event is set, the client is disconnected
-                    return
-                queue.put(chunk)
+                    # If the event is set, the client is disconnected.
+                    # Flush what has been generated, and stop
+                    break
+                now = monotonic()
+                if now - flushed_at >= STREAM_FLUSH_INTERVAL:
+                    queue.put(pending)
+                    pending, flushed_at = None, now
+            if pending is not None:
+                queue.put(pending)
+        finally:
+            _release_completion_generator(cg)
+        # Log outside of the lock, not to delay the next request
+        log_request_and_response(
+            body, cg.completion_status[body.completion_id]
+        )
+
+
+def _copy_chunk(chunk: Dict[str, Any]) -> Dict[str, Any]:
+    """Copy the parts of the chunk that are mutated by the generator"""
+    choice = dict(chunk["choices"][0])
+    if "delta" in choice:
+        choice["delta"] = dict(choice["delta"])
+    return {**chunk, "choices": [choice]}
+
+
+def _merge_chunk_text(pending: Dict[str, Any], chunk: Dict[str, Any]) -> bool:
+    """Append the text of the chunk to the pending chunk, if both of them
+    carry only a piece of text. Return True if the chunk is merged."""
+    pending_choice, choice = pending["choices"][0], chunk["choices"][0]
+    if (
+        pending_choice["finish_reason"] is not None
+        or choice["finish_reason"] is not None
+    ):
+        return False
+    if "delta" in pending_choice and "delta" in choice:
+        # Chat completion chunk
+        if not (
+            pending_choice["delta"].keys()
+            == choice["delta"].keys()
+            == {"content"}
+        ):
+            return False
+        pending_choice["delta"]["content"] += choice["delta"]["content"]
+    elif "text" in pending_choice and "text" in choice:
+        # Text completion chunk
+        if (
+            pending_choice["logprobs"] is not None
+            or choice["logprobs"] is not None
+        ):
+            return False
+        pending_choice["text"] += choice["text"]
+    else:
+        return False
+    pending["created"] = chunk["created"]
+    return True
 
 
 def generate_completion(
@@ -243,17 +302,22 @@ def generate_completion(
     queue: Queue,
     interrupt_signal: Event,
 ) -> None:
-    with queue_manager(queue=queue):
-        with completion_generator_manager(
-            body, llm_model, interrupt_signal
-        ) as cg:
+    with queue_manager(queue=queue), handle_exception():
+        cg = _acquire_completion_generator(llm_model, interrupt_signal)
+        try:
             if isinstance(body, CreateChatCompletionRequest):
                 completion: Union[
                     ChatCompletion, Completion
                 ] = cg.generate_chat_completion(body)
             elif isinstance(body, CreateCompletionRequest):
                 completion = cg.generate_completion(body)
-            queue.put(completion)
+        finally:
+            _release_completion_generator(cg)
+        queue.put(completion)
+        # Log outside of the lock, not to delay the next request
+        log_request_and_response(
+            body, cg.completion_status[body.completion_id]
+        )
 
 
 def generate_embeddings(body: CreateEmbeddingRequest, queue: Queue) -> None:
@@ -339,11 +403,14 @@ def log_request_and_response(
     # Measure the elapsed time, and get information about the request
     elapsed_time = time() - status.started_at
     logs: List[str] = [f"elapsed time: {elapsed_time: .1f}s"]
-    body_without_prompt = body.model_dump(
-        exclude={"prompt", "messages", "input"},
-        exclude_defaults=True,
-        exclude_unset=True,
-        exclude_none=True,
+    # Serialized by pydantic-core, and embedded into the log as it is
+    body_without_prompt = Fragment(
+        body.model_dump_json(
+            exclude={"prompt", "messages", "input"},
+            exclude_defaults=True,
+            exclude_unset=True,
+            exclude_none=True,
+        )
     )
 
     # Log the embedding status
@@ -367,9 +434,8 @@ def log_request_and_response(
         logger.info(
             f"🦙 [{status.state} for {body.model}]: ({' | '.join(logs)})"
         )
-        return chat_logger.info(
-            dumps(embed_log, option=OPT_INDENT_2).decode()
-        )
+        chat_log_executor.submit(_write_chat_log, embed_log)
+        return
     if not isinstance(status, CompletionStatus):
         return
 
@@ -381,10 +447,9 @@ def log_request_and_response(
         # Log the chat completion status
         chat_log = {
             "request": body_without_prompt,
-            "chat": [
-                body.messages[i].model_dump(exclude_none=True)
-                for i in range(len(body.messages))
-            ]
+            "chat": chat_messages_adapter.dump_python(
+                body.messages, exclude_none=True
+            )
             + [{"role": "assistant", "content": status.generated_text}],
         }
     elif isinstance(body, CreateCompletionRequest):
@@ -399,4 +464,12 @@ def log_request_and_response(
     else:
         return
     logger.info(f"🦙 [{status.state} for {body.model}]: ({' | '.join(logs)})")
-    chat_logger.info(dumps(chat_log, option=OPT_INDENT_2).decode())
+    chat_log_executor.submit(_write_chat_log, chat_log)
+
+
+def _write_chat_log(chat_log: Dict[str, Any]) -> None:
+    """Serialize the chat log, and write it to the chat log file"""
+    with logger.log_any_error(
+        "Error writing a chat log", suppress_exception=True
+    ):
+        chat_logger.info(dumps(chat_log).decode())
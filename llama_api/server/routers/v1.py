@@ -2,22 +2,23 @@
 Use same format as OpenAI API"""
 
 from asyncio import (
-    FIRST_COMPLETED,
-    Task,
+    Future,
+    QueueEmpty,
     create_task,
     ensure_future,
-    sleep,
-    wait,
+    get_running_loop,
 )
-from dataclasses import dataclass, field
+from collections import deque
 from functools import partial
-from queue import Queue
-from random import choice
+from random import randrange
 from threading import Event
+from time import monotonic
 from typing import (
     Any,
     AsyncIterator,
+    Deque,
     Dict,
+    List,
     Optional,
     Tuple,
     Type,
@@ -25,15 +26,10 @@ from typing import (
     Union,
 )
 
-from anyio import (
-    Semaphore,
-    create_memory_object_stream,
-    get_cancelled_exc_class,
-)
+from anyio import get_cancelled_exc_class
 from fastapi import APIRouter, Depends, Request
-from fastapi.concurrency import iterate_in_threadpool, run_in_threadpool
+from fastapi.responses import Response, StreamingResponse
 from orjson import dumps
-from sse_starlette.sse import EventSourceResponse
 
 from ...modules.base import BaseLLMModel
 from ...schemas.api import (
@@ -49,7 +45,9 @@ from ...schemas.api import (
 from ...schemas.models import ReverseProxyModel
 from ...shared.config import MainCliArgs
 from ...utils.concurrency import (
+    AsyncQueueReader,
     get_queue_and_event,
+    put_queue_and_event,
     run_in_processpool_with_wix,
 )
 from ...utils.errors import RouteErrorHandler
@@ -66,16 +64,32 @@ from ..pools.llama import (
 )
 
 LOOP_TIMEOUT = 30.0
+# Weight of the latest request duration in the average latency of a worker
+LATENCY_EWMA_WEIGHT = 0.5
 MAX_WORKERS = int(MainCliArgs.max_workers.value or 1)
 MAX_SEMAPHORES = int(MainCliArgs.max_semaphores.value or 1)
+# Keep proxies from buffering or caching the event stream
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
 
 ChatCompletionContext = Tuple[
-    Request, CreateChatCompletionRequest, BaseLLMModel, int, Queue, Event
+    Request,
+    CreateChatCompletionRequest,
+    BaseLLMModel,
+    int,
+    AsyncQueueReader,
+    Event,
 ]
 CompletionContext = Tuple[
-    Request, CreateCompletionRequest, BaseLLMModel, int, Queue, Event
+    Request,
+    CreateCompletionRequest,
+    BaseLLMModel,
+    int,
+    AsyncQueueReader,
+    Event,
+]
+EmbeddingContext = Tuple[
+    Request, CreateEmbeddingRequest, int, AsyncQueueReader, Event
 ]
-EmbeddingContext = Tuple[Request, CreateEmbeddingRequest, int, Queue, Event]
 T = TypeVar("T")
 
 logger = ApiLogger(__name__)
@@ -84,65 +98,154 @@ reverse_proxy = ReverseProxy(
     base_url="https://api.openai.com",
     headers=get_openai_authorization_header(),
 )
-
-
-@dataclass
-class WixMetadata:
-    """Worker index (wix) metadata"""
-
-    wix: int
-    processed_key: Optional[str] = None
-    semaphore: Semaphore = field(
-        default_factory=lambda: Semaphore(MAX_SEMAPHORES)
-    )
+# The encoded model list, and the mapping sources it's built from
+_models_cache = None  # type: Optional[Tuple[Tuple[Any, ...], bytes]]
+_model_data_cache = {}  # type: Dict[str, Tuple[BaseLLMModel, ModelData]]
 
 
 class WixHandler:
     """An utility class to handle worker index (wix) metadata.
     Wix is used to keep track of which worker is currently
     processing a request. This is used to prevent multiple requests from
-    creating multiple completion generators at the same time."""
-
-    wix_metas: Tuple[WixMetadata, ...] = tuple(
-        WixMetadata(wix) for wix in range(MAX_WORKERS)
-    )
+    creating multiple completion generators at the same time.
+    The metadata is laid out as parallel lists indexed by wix,
+    so that ranking the workers only walks the fields it needs."""
+
+    # The key of the model that each worker has processed last
+    processed_keys: List[Optional[str]] = [None] * MAX_WORKERS
+    # The number of requests currently holding a slot of each worker
+    in_flight: List[int] = [0] * MAX_WORKERS
+    # Exponentially weighted moving average of the request durations
+    ewma_latencies: List[float] = [0.0] * MAX_WORKERS
+    # Requests waiting for a free slot of each worker, in arrival order
+    _waiters: List["Deque[Future[None]]"] = [
+        deque() for _ in range(MAX_WORKERS)
+    ]
+    # The last worker that has been assigned to each key
+    _key_to_wix: Dict[str, int] = {}
 
     @classmethod
-    def get_wix_meta(cls, request_key: Optional[str] = None) -> WixMetadata:
-        """Get the worker index (wix) metadata for the key"""
-        worker_ranks = [
-            cls._get_worker_rank(wix_meta, request_key)
-            for wix_meta in cls.wix_metas
-        ]
-        min_rank = min(worker_ranks)
-
-        # Choose a random worker index (wix) with the lowest rank
-        candidates = [
-            i for i, rank in enumerate(worker_ranks) if rank == min_rank
-        ]
-        if not candidates:
-            raise LookupError("No available wix")
-        return cls.wix_metas[choice(candidates)]
-
-    @staticmethod
-    def _get_worker_rank(
-        meta: WixMetadata, request_key: Optional[str]
-    ) -> int:
-        """Get the entry rank for the worker index (wix) metadata.
+    def get_wix(cls, request_key: Optional[str] = None) -> int:
+        """Get the worker index (wix) for the key.
         Lower rank means higher priority of the worker to process the request.
         If the rank is -2, then the worker is processing the same model
         If the rank is -1, then the worker is not processing any model
         If the rank is greater than or equal to 0,
-        then the worker is processing a different model"""
-        if request_key == meta.processed_key:
-            # If the key is the same (worker is processing the same model)
-            return -2  # return the highest priority
-        if request_key is None or meta.processed_key is None:
-            # If not requesting a specific model or worker is not processing
-            return -1  # return the second highest priority
-        return (
-            MAX_SEMAPHORES - meta.semaphore._value
-        )  # return the number of slots in use
+        then the worker is processing a different model, and the rank is
+        the number of requests holding or waiting for a slot.
+        Workers of the same rank are ordered by the number of requests
+        holding or waiting for a slot, then by the shortest average
+        request duration, and the remaining ties are broken at random.
+        If the last worker assigned to the key still holds the model
+        and has a free slot, it's chosen without ranking the workers."""
+        processed_keys = cls.processed_keys
+        in_flight = cls.in_flight
+        waiters = cls._waiters
+        if request_key is not None:
+            wix = cls._key_to_wix.get(request_key)
+            if (
+                wix is not None
+                and processed_keys[wix] == request_key
+                and in_flight[wix] < MAX_SEMAPHORES
+                and not waiters[wix]
+            ):
+                return wix
+        ewma_latencies = cls.ewma_latencies
+        best_wix = -1
+        best_rank = best_load = ties = 0
+        best_latency = 0.0
+        for wix in range(len(processed_keys)):
+            processed_key = processed_keys[wix]
+            load = in_flight[wix] + len(waiters[wix])
+            if request_key == processed_key:
+                rank = -2
+            elif request_key is None or processed_key is None:
+                rank = -1
+            else:
+                rank = load
+            latency = ewma_latencies[wix]
+            if (
+                best_wix < 0
+                or rank < best_rank
+                or (rank == best_rank and load < best_load)
+                or (
+                    rank == best_rank
+                    and load == best_load
+                    and latency < best_latency
+                )
+            ):
+                best_wix, best_rank, best_load = wix, rank, load
+                best_latency, ties = latency, 1
+            elif (
+                rank == best_rank
+                and load == best_load
+                and latency == best_latency
+            ):
+                # Reservoir sampling to choose one of the ties uniformly
+                ties += 1
+                if randrange(ties) == 0:
+                    best_wix = wix
+        if best_wix < 0:
+            raise LookupError("No available wix")
+        return best_wix
+
+    @classmethod
+    def set_processed_key(cls, wix: int, key: Optional[str]) -> None:
+        """Mark the worker as processing the key"""
+        cls.processed_keys[wix] = key
+        if key is not None:
+            cls._key_to_wix[key] = wix
+
+    @classmethod
+    async def acquire(cls, wix: int) -> None:
+        """Reserve a slot of the worker, waiting until one is free.
+        Waiters are served in arrival order, and a new request can't take
+        a slot ahead of them, so that no request starves."""
+        waiters = cls._waiters[wix]
+        if cls.in_flight[wix] < MAX_SEMAPHORES and not waiters:
+            # Fast path: no other coroutine can run in between
+            cls.in_flight[wix] += 1
+            return
+        waiter = get_running_loop().create_future()  # type: Future[None]
+        waiters.append(waiter)
+        try:
+            await waiter
+        except BaseException:
+            if waiter.done() and not waiter.cancelled():
+                # The slot is already handed over, so pass it on
+                cls.release(wix)
+            elif waiter in waiters:
+                # Not popped by `release` yet, which skips it otherwise
+                waiters.remove(waiter)
+            raise
+
+    @classmethod
+    def release(cls, wix: int, duration: Optional[float] = None) -> None:
+        """Free the slot of the worker, handing it over to the first waiter
+        if any. The duration of the request updates the average latency."""
+        if duration is not None:
+            ewma_latencies = cls.ewma_latencies
+            ewma_latencies[wix] += LATENCY_EWMA_WEIGHT * (
+                duration - ewma_latencies[wix]
+            )
+        waiters = cls._waiters[wix]
+        while waiters:
+            waiter = waiters.popleft()
+            if not waiter.done():
+                # The slot stays in use, on behalf of the waiter
+                waiter.set_result(None)
+                return
+        cls.in_flight[wix] -= 1
+
+
+def release_queue_reader(
+    wix: int, reader: AsyncQueueReader, interrupt_signal: Event
+) -> None:
+    """Stop the reader, and put back its queue and the interrupt signal
+    for reuse if the producer is done with them, or never used them"""
+    reader.close()
+    if reader.is_finished or not reader.is_started:
+        put_queue_and_event(wix, reader.queue, interrupt_signal)
 
 
 def validate_item_type(item: Any, type: Type[T]) -> T:
@@ -159,28 +262,23 @@ def validate_item_type(item: Any, type: Type[T]) -> T:
 
 
 async def get_first_response(
-    request: Request, queue: Queue, task: Task
+    request: Request, reader: AsyncQueueReader
 ) -> Dict:
-    async def check_client_connection():
-        while True:
-            await sleep(1.0)
-            if await request.is_disconnected() or task.cancelled():
-                raise get_cancelled_exc_class()()
-
-    done, pending = await wait(
-        {
-            ensure_future(run_in_threadpool(queue.get)),
-            ensure_future(check_client_connection()),
-        },
-        return_when=FIRST_COMPLETED,
-    )
-    if pending:
-        for t in pending:
-            t.cancel()
-    if not done:
-        raise get_cancelled_exc_class()()
-
-    return validate_item_type(done.pop().result(), type=dict)
+    get_task = ensure_future(reader.get())
+
+    async def cancel_on_disconnection():
+        # The body is already consumed, so the next message
+        # is expected to arrive only when the client disconnects
+        while (await request.receive())["type"] != "http.disconnect":
+            pass
+        get_task.cancel()
+
+    listener = ensure_future(cancel_on_disconnection())
+    try:
+        # Raises CancelledError if the client has disconnected
+        return validate_item_type(await get_task, type=dict)
+    finally:
+        listener.cancel()
 
 
 async def get_chat_or_text_completion(
@@ -188,11 +286,14 @@ async def get_chat_or_text_completion(
 ) -> Union[ChatCompletion, Completion]:
     """Create a chat completion or completion based on the body."""
     task = None  # To avoid UnboundLocalError
-    request, body, llm_model, wix, queue, event = ctx
+    request, body, llm_model, wix, reader, event = ctx
     try:
-        func = partial(generate_completion, body, llm_model, queue, event)
+        reader.start()
+        func = partial(
+            generate_completion, body, llm_model, reader.queue, event
+        )
         task = create_task(run_in_processpool_with_wix(func, wix=wix))
-        completion = await get_first_response(request, queue, task)
+        completion = await get_first_response(request, reader)
         return completion  # type: ignore
     finally:
         event.set()
@@ -202,39 +303,57 @@ async def get_chat_or_text_completion(
 
 async def get_chat_or_text_completion_streaming(
     ctx: Union[ChatCompletionContext, CompletionContext],
-) -> EventSourceResponse:
+) -> StreamingResponse:
     """Create a chat completion or completion based on the body, and stream"""
     task = None
-    request, body, llm_model, wix, queue, event = ctx
+    request, body, llm_model, wix, reader, event = ctx
     try:
+        reader.start()
         func = partial(
-            generate_completion_chunks, body, llm_model, queue, event
+            generate_completion_chunks, body, llm_model, reader.queue, event
         )
         task = create_task(run_in_processpool_with_wix(func, wix=wix))
-        first_chunk = await get_first_response(request, queue, task)
-        send_chan, recv_chan = create_memory_object_stream(10)
+        first_chunk = await get_first_response(request, reader)
 
-        async def get_event_publisher() -> None:
+        async def get_event_publisher() -> AsyncIterator[bytes]:
             try:
-
-                def iterator():
-                    yield first_chunk
+                batch = [first_chunk]  # type: List[Any]
+                done = False
+                while True:
+                    # Drain whatever else has arrived,
+                    # so that a burst is sent at once
                     while True:
-                        gen = queue.get(timeout=LOOP_TIMEOUT)
-                        if gen is None:
-                            break  # The producer task is done
-                        yield validate_item_type(gen, type=dict)
-
-                async for chunk in iterate_in_threadpool(iterator()):
-                    await send_chan.send(b"data: " + dumps(chunk) + b"\n\n")
-                await send_chan.send(b"data: [DONE]\n\n")
+                        try:
+                            batch.append(reader.get_nowait())
+                        except QueueEmpty:
+                            break
+                    # SSE frames of a batch, joined with a single allocation
+                    parts = []  # type: List[bytes]
+                    append = parts.append
+                    for gen in batch:
+                        if gen.__class__ is not dict:
+                            if gen is None:
+                                done = True  # The producer task is done
+                                break
+                            # Raises if it's not a chunk
+                            validate_item_type(gen, type=dict)
+                        append(b"data: ")
+                        append(dumps(gen))
+                        append(b"\n\n")
+                    if done:
+                        append(b"data: [DONE]\n\n")
+                    yield b"".join(parts)
+                    if done:
+                        break
+                    batch = [await reader.get(timeout=LOOP_TIMEOUT)]
             finally:
                 event.set()
                 task.cancel()
-                send_chan.close()
 
-        return EventSourceResponse(
-            recv_chan, data_sender_callable=get_event_publisher
+        return StreamingResponse(
+            get_event_publisher(),
+            media_type="text/event-stream",
+            headers=SSE_HEADERS,
         )
 
     except Exception:
@@ -249,11 +368,12 @@ async def get_embedding(
 ) -> Embedding:
     """Create a chat completion or completion based on the body."""
     task = None  # To avoid UnboundLocalError
-    request, body, wix, queue, _ = ctx
+    request, body, wix, reader, _ = ctx
     try:
-        func = partial(generate_embeddings, body, queue)
+        reader.start()
+        func = partial(generate_embeddings, body, reader.queue)
         task = create_task(run_in_processpool_with_wix(func, wix=wix))
-        embeddings = await get_first_response(request, queue, task)
+        embeddings = await get_first_response(request, reader)
         return embeddings  # type: ignore
     finally:
         if task is not None:
@@ -264,46 +384,54 @@ async def get_chat_completion_context(
     request: Request, body: CreateChatCompletionRequest
 ) -> AsyncIterator[ChatCompletionContext]:
     llm_model = ModelDefinitions.get_llm_model_from_request_body(body)
-    interrupt_signal = None  # To avoid UnboundLocalError
-    wix_meta = WixHandler.get_wix_meta(body.model)
+    interrupt_signal = reader = None  # To avoid UnboundLocalError
+    wix = WixHandler.get_wix(body.model)
 
-    # Acquire the semaphore for the worker index (wix)
-    await wix_meta.semaphore.acquire()
+    # Acquire a slot of the worker index (wix)
+    await WixHandler.acquire(wix)
+    started_at = monotonic()
     try:
         if await request.is_disconnected():
             # If client is already gone, then ignore the request
             raise get_cancelled_exc_class()()
         # Reserve the worker, it is now processing the request
-        wix_meta.processed_key = body.model
-        queue, interrupt_signal = get_queue_and_event()
-        yield request, body, llm_model, wix_meta.wix, queue, interrupt_signal
+        WixHandler.set_processed_key(wix, body.model)
+        queue, interrupt_signal = get_queue_and_event(wix)
+        reader = AsyncQueueReader(queue)
+        yield request, body, llm_model, wix, reader, interrupt_signal
     finally:
-        wix_meta.semaphore.release()
+        WixHandler.release(wix, monotonic() - started_at)
         if interrupt_signal is not None:
             interrupt_signal.set()
+        if reader is not None:
+            release_queue_reader(wix, reader, interrupt_signal)
 
 
 async def get_completion_context(
     request: Request, body: CreateCompletionRequest
 ) -> AsyncIterator[CompletionContext]:
     llm_model = ModelDefinitions.get_llm_model_from_request_body(body)
-    interrupt_signal = None  # To avoid UnboundLocalError
-    wix_meta = WixHandler.get_wix_meta(body.model)
+    interrupt_signal = reader = None  # To avoid UnboundLocalError
+    wix = WixHandler.get_wix(body.model)
 
-    # Acquire the semaphore for the worker index (wix)
-    await wix_meta.semaphore.acquire()
+    # Acquire a slot of the worker index (wix)
+    await WixHandler.acquire(wix)
+    started_at = monotonic()
     try:
         if await request.is_disconnected():
             # If client is already gone, then ignore the request
             raise get_cancelled_exc_class()()
         # Reserve the worker, it is now processing the request
-        wix_meta.processed_key = body.model
-        queue, interrupt_signal = get_queue_and_event()
-        yield request, body, llm_model, wix_meta.wix, queue, interrupt_signal
+        WixHandler.set_processed_key(wix, body.model)
+        queue, interrupt_signal = get_queue_and_event(wix)
+        reader = AsyncQueueReader(queue)
+        yield request, body, llm_model, wix, reader, interrupt_signal
     finally:
-        wix_meta.semaphore.release()
+        WixHandler.release(wix, monotonic() - started_at)
         if interrupt_signal is not None:
             interrupt_signal.set()
+        if reader is not None:
+            release_queue_reader(wix, reader, interrupt_signal)
 
 
 async def get_embedding_context(
@@ -312,23 +440,27 @@ async def get_embedding_context(
     if MainCliArgs.no_embed.value:
         raise PermissionError("Embeddings endpoint is disabled")
     assert body.model is not None, "Model is required"
-    interrupt_signal = None  # To avoid UnboundLocalError
-    wix_meta = WixHandler.get_wix_meta(body.model)
+    interrupt_signal = reader = None  # To avoid UnboundLocalError
+    wix = WixHandler.get_wix(body.model)
 
-    # Acquire the semaphore for the worker index (wix)
-    await wix_meta.semaphore.acquire()
+    # Acquire a slot of the worker index (wix)
+    await WixHandler.acquire(wix)
+    started_at = monotonic()
     try:
         if await request.is_disconnected():
             # If client is already gone, then ignore the request
             raise get_cancelled_exc_class()()
         # Reserve the worker, it is now processing the request
-        wix_meta.processed_key = body.model
-        queue, interrupt_signal = get_queue_and_event()
-        yield request, body, wix_meta.wix, queue, interrupt_signal
+        WixHandler.set_processed_key(wix, body.model)
+        queue, interrupt_signal = get_queue_and_event(wix)
+        reader = AsyncQueueReader(queue)
+        yield request, body, wix, reader, interrupt_signal
     finally:
-        wix_meta.semaphore.release()
+        WixHandler.release(wix, monotonic() - started_at)
         if interrupt_signal is not None:
             interrupt_signal.set()
+        if reader is not None:
+            release_queue_reader(wix, reader, interrupt_signal)
 
 
 @router.post("/chat/completions")
@@ -369,20 +501,45 @@ async def create_embedding(
     return await get_embedding(ctx)
 
 
-@router.get("/models")
-async def get_models() -> ModelList:
-    return ModelList(
-        object="list",
-        data=[
-            ModelData(
-                id=model_name,
-                object="model",
-                owned_by=llm_model.__class__.__name__,
-                permissions=[
-                    f"{key}:{value}"
-                    for key, value in llm_model.asdict.items()
-                ],
+def _build_model_data(
+    model_mappings: Dict[str, BaseLLMModel]
+) -> List[ModelData]:
+    """Build the model data of the mappings, reusing the entries
+    whose model definitions are the same objects as in the last build"""
+    global _model_data_cache
+    model_data_cache = {}  # type: Dict[str, Tuple[BaseLLMModel, ModelData]]
+    for model_name, llm_model in model_mappings.items():
+        entry = _model_data_cache.get(model_name)
+        if entry is None or entry[0] is not llm_model:
+            entry = (
+                llm_model,
+                ModelData(
+                    id=model_name,
+                    object="model",
+                    owned_by=llm_model.__class__.__name__,
+                    permissions=[
+                        f"{key}:{value}"
+                        for key, value in llm_model.asdict.items()
+                    ],
+                ),
             )
-            for model_name, llm_model in ModelDefinitions.get_all_model_mappings().items()  # noqa: E501
-        ],
-    )
+        model_data_cache[model_name] = entry
+    _model_data_cache = model_data_cache
+    return [model_data for _, model_data in model_data_cache.values()]
+
+
+@router.get("/models", response_model=ModelList)
+async def get_models() -> Response:
+    global _models_cache
+    # The sources are replaced when the model definitions are reloaded
+    sources = ModelDefinitions.get_mapping_sources()
+    if _models_cache is None or any(
+        source is not cached
+        for source, cached in zip(sources, _models_cache[0])
+    ):
+        model_list = ModelList(
+            object="list",
+            data=_build_model_data(ModelDefinitions.get_all_model_mappings()),
+        )
+        _models_cache = (sources, dumps(model_list))
+    return Response(_models_cache[1], media_type="application/json")
@@ -88,6 +88,14 @@ class MainCliArgs(AppSettingsCliArgs):
         help="Maximum number of process semaphores to permit; default is 1",
         default=1,
     )
+    max_cached_models: CliArg[int] = CliArg(
+        type=int,
+        help=(
+            "Maximum number of models to keep loaded per worker. "
+            "The least recently used model is unloaded first; default is 1"
+        ),
+        default=1,
+    )
     max_tokens_limit: CliArg[int] = CliArg(
         type=int,
         short_option="l",
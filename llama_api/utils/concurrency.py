@@ -1,12 +1,24 @@
-from asyncio import AbstractEventLoop, Future, wrap_future
-from concurrent.futures import Executor
+from asyncio import AbstractEventLoop, Future, QueueEmpty
+from asyncio import TimeoutError as AsyncioTimeoutError
+from asyncio import get_running_loop, wrap_future
+from collections import deque
+from concurrent.futures import Executor, ThreadPoolExecutor
 from contextlib import contextmanager
 from multiprocessing.managers import SyncManager
 from os import environ
-from queue import Queue
+from queue import Empty, Queue
 from sys import version_info
 from threading import Event
-from typing import Callable, Dict, Optional, Tuple, TypeVar
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+)
 
 from fastapi.concurrency import run_in_threadpool
 
@@ -27,6 +39,10 @@ P = ParamSpec("P")
 logger = ApiLogger(__name__)
 _pool: Optional[ProcessPool] = None
 _manager: Optional[SyncManager] = None
+# Idle queue and event pairs of each worker, to be reused by requests
+_idle_queues_and_events: Dict[int, List[Tuple[Queue, Event]]] = {}
+# Threads reading the queues of the requests, reused across requests
+_reader_executor: Optional[ThreadPoolExecutor] = None
 
 
 def init_process_pool(env_vars: Dict[str, str]) -> None:
@@ -107,10 +123,21 @@ async def run_in_processpool(
     return await run_in_threadpool(pool().run, func, *args, **kwargs)
 
 
-def get_queue_and_event() -> Tuple[Queue, Event]:
+def get_queue_and_event(wix: Optional[int] = None) -> Tuple[Queue, Event]:
     """Get a multiprocessing queue and event.
-    This is useful when you want to communicate between processes."""
+    This is useful when you want to communicate between processes.
+    If the worker index (wix) is given, an idle pair of the worker
+    is reused if there is any."""
     global _manager
+    if wix is not None:
+        idle_pairs = _idle_queues_and_events.get(wix)
+        while idle_pairs:
+            queue, event = idle_pairs.pop()
+            try:
+                event.clear()
+            except Exception:
+                continue  # e.g. The manager process is gone
+            return queue, event
     if _manager is None:
         _manager = SyncManager()
         _manager.start()
@@ -118,11 +145,132 @@ def get_queue_and_event() -> Tuple[Queue, Event]:
         return _manager.Queue(), _manager.Event()
     except Exception:
         _manager.shutdown()
+        _idle_queues_and_events.clear()
         _manager = SyncManager()
         _manager.start()
         return _manager.Queue(), _manager.Event()
 
 
+def put_queue_and_event(wix: int, queue: Queue, event: Event) -> None:
+    """Put back the queue and event pair of the worker index (wix),
+    so that the next request to the worker can reuse it.
+    The producer must be done with the queue, and the queue must be empty."""
+    _idle_queues_and_events.setdefault(wix, []).append((queue, event))
+
+
+def reader_executor() -> ThreadPoolExecutor:
+    """Get the executor of the queue readers. Its threads are reused,
+    along with their connections to the manager, which are per thread."""
+    global _reader_executor
+    if _reader_executor is None:
+        _reader_executor = ThreadPoolExecutor(
+            # Enough for every slot, and the readers being closed
+            max_workers=2
+            * (MainCliArgs.max_workers.value or 1)
+            * (MainCliArgs.max_semaphores.value or 1),
+            thread_name_prefix="queue-reader",
+        )
+    return _reader_executor
+
+
+class AsyncQueueReader:
+    """Read items from a (multiprocessing) queue in the event loop.
+    A thread of the reader executor blocks on the queue and hands each item
+    over to the event loop, so that awaiting an item doesn't borrow
+    a thread from the threadpool every time.
+    Reading starts at `start` or the first `get`,
+    so an unused reader takes no thread.
+    The reader stops after the producer puts None or an exception,
+    and then `is_finished` tells that nothing is left in the queue."""
+
+    def __init__(self, queue: Queue, poll_interval: float = 1.0) -> None:
+        self.queue = queue
+        self.poll_interval = poll_interval
+        self._loop = get_running_loop()
+        self._items = deque()  # type: Deque[Any]
+        self._waiter = None  # type: Optional[Future[None]]
+        self._closed = False
+        self.is_started = False
+        self.is_finished = False
+
+    def start(self) -> None:
+        """Start reading the queue, before its producer may put any item"""
+        if not self.is_started:
+            self.is_started = True
+            reader_executor().submit(self._read)
+
+    def _read(self) -> None:
+        loop = self._loop
+        call_soon_threadsafe = loop.call_soon_threadsafe
+        put_nowait = self._put_nowait
+        while not self._closed and not loop.is_closed():
+            try:
+                item = self.queue.get(timeout=self.poll_interval)
+                is_from_producer = True
+            except Empty:
+                continue  # Check if the reader is closed
+            except Exception as e:
+                item = e  # e.g. The manager process is gone
+                is_from_producer = False
+            is_last = item is None or isinstance(item, Exception)
+            if is_last:
+                # The producer is done, or the queue is broken.
+                # Set before handing over the item, so that the consumer
+                # sees it as soon as it gets the last item
+                self.is_finished = is_from_producer
+            try:
+                call_soon_threadsafe(put_nowait, item)
+            except RuntimeError:
+                return  # The event loop is closed
+            if is_last:
+                return
+
+    def _put_nowait(self, item: Any) -> None:
+        self._items.append(item)
+        waiter = self._waiter
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    async def get(self, timeout: Optional[float] = None) -> Any:
+        """Wait for the next item of the queue, and raise
+        asyncio.TimeoutError if it doesn't arrive within the timeout.
+        The timeout is a single timer of the event loop,
+        so that no task is created to wait for each item."""
+        self.start()
+        if not self._items:
+            loop = self._loop
+            waiter = self._waiter = loop.create_future()
+            timer = (
+                None
+                if timeout is None
+                else loop.call_later(timeout, _set_timeout, waiter)
+            )
+            try:
+                await waiter
+            finally:
+                self._waiter = None
+                if timer is not None:
+                    timer.cancel()
+        return self._items.popleft()
+
+    def get_nowait(self) -> Any:
+        """Get an item that has already arrived,
+        or raise asyncio.QueueEmpty if there is none"""
+        self.start()
+        if not self._items:
+            raise QueueEmpty
+        return self._items.popleft()
+
+    def close(self) -> None:
+        """Stop the reader thread from reading the queue"""
+        self._closed = True
+
+
+def _set_timeout(waiter: "Future[None]") -> None:
+    if not waiter.done():
+        waiter.set_exception(AsyncioTimeoutError())
+
+
 @contextmanager
 def queue_manager(queue: Queue):
     try:
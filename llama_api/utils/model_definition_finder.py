@@ -1,8 +1,9 @@
+from functools import lru_cache
 from importlib import import_module, reload
 from os import environ
 from pathlib import Path
 from types import ModuleType
-from typing import Dict, Tuple, Union
+from typing import Dict, Optional, Tuple, Union
 
 
 from ..schemas.api import (
@@ -25,6 +26,10 @@ class ModelDefinitions:
     modules: Dict[str, ModuleType] = {}
     last_modified: Dict[str, float] = {}
     no_model_definitions_warned: bool = False
+    # Mappings collected from the modules, until any of them is reloaded
+    _module_mappings: Optional[
+        Tuple[Dict[str, BaseLLMModel], Dict[str, str]]
+    ] = None
 
     MODULE_GLOB_PATTERN = "*model*def*.py"
     ENVIRON_KEY_PATTERN = ("model", "def")
@@ -94,16 +99,32 @@ class ModelDefinitions:
         """Get the model mappings (name -> definition)
         from the environment variables and the model definition modules.
         OpenAI models are mapped to LLaMA models if they exist."""
-        cls._refresh_modules()
-        mmaps_env, ommaps_env = cls._collect_from_environs()
-        mmaps_module, ommaps_mod = cls._collect_from_modules()
+        module_mappings, environ_mappings = cls.get_mapping_sources()
+        mmaps_module, ommaps_mod = module_mappings
+        mmaps_env, ommaps_env = environ_mappings
         return {**mmaps_module, **mmaps_env}, {**ommaps_mod, **ommaps_env}
 
     @classmethod
-    def _load_or_reload_module(cls, path: Path) -> None:
+    def get_mapping_sources(
+        cls,
+    ) -> Tuple[
+        Tuple[Dict[str, BaseLLMModel], Dict[str, str]],
+        Tuple[Dict[str, BaseLLMModel], Dict[str, str]],
+    ]:
+        """Get the mappings collected from the modules and from the
+        environment variables, reloading the modules if modified.
+        Each of them stays the same object until its source changes."""
+        if cls._refresh_modules() or cls._module_mappings is None:
+            cls._module_mappings = cls._collect_from_modules()
+        return cls._module_mappings, cls._collect_from_environs()
+
+    @classmethod
+    def _load_or_reload_module(cls, path: Path) -> bool:
+        """Load or reload the module if it's modified.
+        Returns True if the module is (re)loaded."""
         module_name = path.stem
         if module_name == "__init__":
-            return
+            return False
 
         current_time = path.stat().st_mtime
         if cls._module_is_modified(module_name, current_time):
@@ -115,10 +136,12 @@ class ModelDefinitions:
                     else import_module(module_name)
                 )
                 cls.last_modified[module_name] = current_time
+                return True
             except Exception as e:
                 logger.error(
                     f"Failed to load or reload module {module_name}: {e}"
                 )
+        return False
 
     @classmethod
     def _module_is_modified(
@@ -158,20 +181,30 @@ class ModelDefinitions:
                 and value.startswith("{")
                 and value.endswith("}")
             ):
-                model_definitions = dict(loads(value))
+                model_definitions = value
             if (
                 openai_replacement_models is None
                 and "openai" in key
                 and value.startswith("{")
                 and value.endswith("}")
             ):
-                openai_replacement_models = {
-                    k.lower(): v.lower() for k, v in loads(value).items()
-                }
+                openai_replacement_models = value
+        return cls._parse_environs(
+            model_definitions, openai_replacement_models
+        )
 
+    @classmethod
+    @lru_cache(maxsize=8)
+    def _parse_environs(
+        cls,
+        model_definitions: Optional[str],
+        openai_replacement_models: Optional[str],
+    ) -> Tuple[Dict[str, BaseLLMModel], Dict[str, str]]:
+        """Build the model definitions from the JSON values of environs.
+        Cached, so that the models are built only once per value."""
         llm_models = {}  # type: Dict[str, BaseLLMModel]
         if model_definitions is not None:
-            for key, value in model_definitions.items():
+            for key, value in dict(loads(model_definitions)).items():
                 key = key.lower()
                 if isinstance(value, dict) and "type" in value:
                     type = value.pop("type")
@@ -183,10 +216,17 @@ class ModelDefinitions:
                         raise ValueError(
                             f"Unknown model type: {value['type']}"
                         )
-        return llm_models, openai_replacement_models or {}
+        if openai_replacement_models is None:
+            return llm_models, {}
+        return llm_models, {
+            k.lower(): v.lower()
+            for k, v in loads(openai_replacement_models).items()
+        }
 
     @classmethod
-    def _refresh_modules(cls) -> None:
+    def _refresh_modules(cls) -> bool:
+        """Load the model definition modules, or reload them if modified.
+        Returns True if any of the modules is (re)loaded."""
         model_definition_paths = []  # type: list[Path]
 
         for path in Path(".").glob(cls.MODULE_GLOB_PATTERN):
@@ -208,5 +248,7 @@ class ModelDefinitions:
             cls.no_model_definitions_warned = True
 
         # Load model_definitions.py first and then the rest
+        is_reloaded = False
         for path in model_definition_paths:
-            cls._load_or_reload_module(path)
+            is_reloaded |= cls._load_or_reload_module(path)
+        return is_reloaded
@@ -134,7 +134,8 @@ def free_memory_of_first_item_from_container(
     if isinstance(_container, deque):
         item = _container.popleft()
     elif isinstance(_container, dict):
-        item = _container.popitem()
+        # Dicts keep the insertion order, so the first key is the oldest
+        item = _container.pop(next(iter(_container)))
     elif isinstance(_container, list):
         item = _container.pop(0)
     elif hasattr(_container, "get_nowait"):
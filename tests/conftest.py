@@ -240,22 +240,26 @@ class TestLlamaAPI(unittest.TestCase):
         self.assertEqual(len(results), len(models))
         return results
 
+    @staticmethod
     async def extract_json_from_streaming_response(
-        self,
         response: "Response",
     ) -> AsyncIterator[Union[CompletionChunk, ChatCompletionChunk]]:
-        """Extract json from streaming `httpx.Response`"""
+        """Extract json from streaming `httpx.Response`.
+        A body chunk may hold several events, or a part of an event"""
         regex_finder = compile(rb"data:\s*({.+?})\s*\r?\n\s*\r?\n").finditer
-        bytes_buffer = bytearray()
+        bytes_buffer = b""
         async for stream in response.aiter_bytes():
-            bytes_buffer.extend(stream)
+            bytes_buffer += stream
+            end = 0
             for match in regex_finder(bytes_buffer):
+                end = match.end()
                 try:
                     json_data = loads(match.group(1))
-                    yield json_data
-                    bytes_buffer.clear()
                 except Exception:
                     continue
+                yield json_data
+            # Keep the incomplete event for the next body chunk
+            bytes_buffer = bytes_buffer[end:]
 
     @staticmethod
     def union(*dicts: Dict) -> Dict:
@@ -0,0 +1,185 @@
+import unittest
+from contextlib import ExitStack
+from queue import Queue
+from threading import Event
+from typing import Any, Dict, Iterator, List, Optional, Union
+from unittest.mock import MagicMock, patch
+
+from llama_api.schemas.api import (
+    APIChatMessage,
+    CreateChatCompletionRequest,
+    CreateCompletionRequest,
+)
+from llama_api.server.pools import llama
+from llama_api.server.pools.llama import generate_completion_chunks
+
+
+def chat_chunks(
+    pieces: List[str], interrupt: Optional[Event] = None
+) -> Iterator[Dict[str, Any]]:
+    """Yield chat completion chunks the way the generators do,
+    mutating a single chunk. If the interrupt signal is given,
+    it's set before the last chunk, as if the client is gone."""
+    chunk = {
+        "id": "chatcmpl-test",
+        "object": "chat.completion.chunk",
+        "created": 0,
+        "model": "test",
+        "choices": [
+            {
+                "index": 0,
+                "delta": {"role": "assistant"},
+                "finish_reason": None,
+            }
+        ],
+    }  # type: Dict[str, Any]
+    yield chunk
+    for created, piece in enumerate(pieces, start=1):
+        chunk["created"] = created
+        chunk["choices"][0]["delta"] = {"content": piece}
+        yield chunk
+    if interrupt is not None:
+        interrupt.set()
+    chunk["choices"][0]["delta"] = {}
+    chunk["choices"][0]["finish_reason"] = "stop"
+    yield chunk
+    if interrupt is not None:
+        raise AssertionError("Consumed after the interruption")
+
+
+def text_chunks(pieces: List[str]) -> Iterator[Dict[str, Any]]:
+    """Yield text completion chunks the way the generators do,
+    mutating a single chunk."""
+    chunk = {
+        "id": "cmpl-test",
+        "object": "text_completion",
+        "created": 0,
+        "model": "test",
+        "choices": [
+            {"text": "", "index": 0, "logprobs": None, "finish_reason": None}
+        ],
+    }  # type: Dict[str, Any]
+    for created, piece in enumerate(pieces, start=1):
+        chunk["created"] = created
+        chunk["choices"][0]["text"] = piece
+        yield chunk
+    chunk["choices"][0]["text"] = ""
+    chunk["choices"][0]["finish_reason"] = "length"
+    yield chunk
+
+
+class TestCompletionChunks(unittest.TestCase):
+    """Test that the streamed chunks are coalesced within the flush
+    interval, without losing or reordering any of them."""
+
+    def setUp(self) -> None:
+        self.stack = ExitStack()
+        self.cg = MagicMock()
+        self.monotonic = self.stack.enter_context(
+            patch.object(llama, "monotonic")
+        )
+        self.stack.enter_context(
+            patch.object(
+                llama, "get_completion_generator", return_value=self.cg
+            )
+        )
+        self.stack.enter_context(
+            patch.object(llama, "log_request_and_response")
+        )
+
+    def tearDown(self) -> None:
+        self.stack.close()
+
+    def generate(
+        self,
+        body: Union[CreateChatCompletionRequest, CreateCompletionRequest],
+        chunks: Iterator[Dict[str, Any]],
+        clock: List[float],
+        interrupt_signal: Optional[Event] = None,
+    ) -> List[Dict[str, Any]]:
+        """Run the producer with the chunks and the clock readings,
+        and return the chunks put on the queue until the end."""
+        self.monotonic.side_effect = clock
+        self.cg.generate_chat_completion_with_streaming.return_value = chunks
+        self.cg.generate_completion_with_streaming.return_value = chunks
+        queue = Queue()  # type: Queue[Any]
+        generate_completion_chunks(
+            body, MagicMock(), queue, interrupt_signal or Event()
+        )
+        items = []  # type: List[Dict[str, Any]]
+        while True:
+            item = queue.get_nowait()
+            if item is None:
+                return items
+            self.assertIsInstance(item, dict)
+            items.append(item)
+
+    def test_chat_chunks(self) -> None:
+        """Test that the pieces within 50ms are merged, and that the
+        pending piece is flushed once the interval has passed."""
+        body = CreateChatCompletionRequest(
+            model="test", messages=[APIChatMessage(role="user", content="")]
+        )
+        items = self.generate(
+            body,
+            chat_chunks(["Hel", "lo", "!", " Bye"]),
+            # The first chunk is flushed at once, to start the stream
+            clock=[100.0, 100.01, 100.02, 100.06, 100.07, 100.08],
+        )
+        self.assertEqual(
+            [item["choices"][0]["delta"] for item in items],
+            [
+                {"role": "assistant"},
+                {"content": "Hello!"},
+                {"content": " Bye"},
+                {},
+            ],
+        )
+        self.assertEqual(
+            [item["choices"][0]["finish_reason"] for item in items],
+            [None, None, None, "stop"],
+        )
+        # The merged chunk takes the timestamp of its last piece
+        self.assertEqual([item["created"] for item in items], [0, 3, 4, 4])
+
+    def test_text_chunks(self) -> None:
+        """Test that the text pieces are merged, and that the
+        chunk with the finish reason is never merged."""
+        body = CreateCompletionRequest(model="test", prompt="")
+        items = self.generate(
+            body,
+            text_chunks(["Hel", "lo", ",", " world"]),
+            clock=[100.0, 100.01, 100.02, 100.03, 100.04],
+        )
+        self.assertEqual(
+            [item["choices"][0]["text"] for item in items],
+            ["Hel", "lo, world", ""],
+        )
+        self.assertEqual(
+            [item["choices"][0]["finish_reason"] for item in items],
+            [None, None, "length"],
+        )
+
+    def test_interrupted(self) -> None:
+        """Test that the pending chunk and the last chunk with the
+        finish reason are put on the queue when the request is
+        interrupted, and that nothing is consumed after them."""
+        body = CreateChatCompletionRequest(
+            model="test", messages=[APIChatMessage(role="user", content="")]
+        )
+        interrupt_signal = Event()
+        items = self.generate(
+            body,
+            chat_chunks(["a", "b"], interrupt=interrupt_signal),
+            clock=[100.0, 100.01, 100.02],
+            interrupt_signal=interrupt_signal,
+        )
+        self.assertEqual(
+            [item["choices"][0]["delta"] for item in items],
+            [{"role": "assistant"}, {"content": "ab"}, {}],
+        )
+        self.assertEqual(items[-1]["choices"][0]["finish_reason"], "stop")
+
+
+if __name__ == "__main__":
+    unittest.main()
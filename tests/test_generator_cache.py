@@ -0,0 +1,87 @@
+import unittest
+from contextlib import ExitStack
+from unittest.mock import patch
+
+from llama_api.schemas.api import CreateEmbeddingRequest
+from llama_api.schemas.models import LlamaCppModel
+from llama_api.server.pools import llama
+from llama_api.server.pools.llama import (
+    get_completion_generator,
+    get_embedding_generator,
+)
+from llama_api.shared.config import MainCliArgs
+
+
+class FakeGenerator:
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+
+class TestGeneratorCache(unittest.TestCase):
+    """Test that the generators are cached as LRU caches,
+    sized by `--max-cached-models`."""
+
+    def setUp(self) -> None:
+        self.stack = ExitStack()
+        for cache in (llama.completion_generators, llama.embedding_generators):
+            self.stack.enter_context(patch.dict(cache, clear=True))
+        self.stack.enter_context(
+            patch.object(MainCliArgs.max_cached_models, "value", 2)
+        )
+        self.lazy = self.stack.enter_context(patch.object(llama, "lazy"))
+        for generator in (
+            self.lazy.LlamaCppCompletionGenerator,
+            self.lazy.TransformerEmbeddingGenerator,
+        ):
+            generator.from_pretrained.side_effect = lambda model: (
+                FakeGenerator(getattr(model, "model_path", model))
+            )
+
+    def tearDown(self) -> None:
+        self.stack.close()
+
+    def test_completion_generators(self) -> None:
+        models = {
+            name: LlamaCppModel(model_path=name) for name in ("a", "b", "c")
+        }
+        cache = llama.completion_generators
+        a = get_completion_generator(models["a"])
+        get_completion_generator(models["b"])
+        self.assertEqual(list(cache), ["a", "b"])
+
+        # A cache hit moves the generator to the end
+        self.assertIs(get_completion_generator(models["a"]), a)
+        self.assertEqual(list(cache), ["b", "a"])
+        load = self.lazy.LlamaCppCompletionGenerator.from_pretrained
+        self.assertEqual(load.call_count, 2)
+
+        # The least recently used generator is evicted
+        get_completion_generator(models["c"])
+        self.assertEqual(list(cache), ["a", "c"])
+        self.assertIs(cache["a"], a)
+        self.assertEqual(load.call_count, 3)
+
+    def test_embedding_generators(self) -> None:
+        def get(model: str) -> object:
+            return get_embedding_generator(
+                CreateEmbeddingRequest(model=model, input="")
+            )
+
+        cache = llama.embedding_generators
+        a = get("a")
+        get("b")
+        self.assertIs(get("A"), a)  # The model names are lowercased
+        self.assertEqual(list(cache), ["b", "a"])
+        get("c")
+        self.assertEqual(list(cache), ["a", "c"])
+
+    def test_default_size(self) -> None:
+        """Test that a single generator is kept by default."""
+        MainCliArgs.max_cached_models.value = 1
+        for name in ("a", "b"):
+            get_completion_generator(LlamaCppModel(model_path=name))
+        self.assertEqual(list(llama.completion_generators), ["b"])
+
+
+if __name__ == "__main__":
+    unittest.main()
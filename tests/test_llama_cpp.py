@@ -0,0 +1,51 @@
+import unittest
+from array import array
+from importlib import import_module
+
+import numpy as np
+
+
+class TestLongestTokenPrefix(unittest.TestCase):
+    """Test the common prefix of the token ids, which decides
+    whether the llama.cpp prompt cache is reused."""
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        try:
+            module = import_module("llama_api.modules.llama_cpp")
+        except Exception as e:
+            raise unittest.SkipTest(f"llama.cpp is not available: {e}")
+        cls.longest_token_prefix = staticmethod(module._longest_token_prefix)
+
+    def prefix(self, cached: list, ids: list) -> int:
+        # The prompt ids are viewed from an array, like in `_load_cache`
+        return self.longest_token_prefix(
+            np.asarray(cached, dtype=np.intc),
+            np.frombuffer(array("i", ids), dtype=np.intc),
+        )
+
+    def test_equal(self) -> None:
+        self.assertEqual(self.prefix([1, 2, 3], [1, 2, 3]), 3)
+
+    def test_shorter(self) -> None:
+        self.assertEqual(self.prefix([1, 2], [1, 2, 3]), 2)
+
+    def test_longer(self) -> None:
+        self.assertEqual(self.prefix([1, 2, 3, 4], [1, 2, 3]), 3)
+
+    def test_diverging(self) -> None:
+        self.assertEqual(self.prefix([1, 2, 9, 4], [1, 2, 3, 4]), 2)
+        self.assertEqual(self.prefix([9, 2, 3], [1, 2, 3]), 0)
+
+    def test_empty(self) -> None:
+        self.assertEqual(self.prefix([], [1, 2, 3]), 0)
+        self.assertEqual(self.prefix([1, 2, 3], []), 0)
+        self.assertEqual(self.prefix([], []), 0)
+
+    def test_returns_int(self) -> None:
+        self.assertIs(type(self.prefix([1, 2], [1, 3])), int)
+        self.assertIs(type(self.prefix([1, 2], [1, 2])), int)
+
+
+if __name__ == "__main__":
+    unittest.main()
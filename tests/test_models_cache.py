@@ -0,0 +1,78 @@
+import unittest
+from contextlib import ExitStack
+from typing import List
+from unittest.mock import patch
+
+from orjson import loads
+
+from llama_api.schemas.models import LlamaCppModel
+from llama_api.server.routers import v1
+from llama_api.utils.model_definition_finder import ModelDefinitions
+
+
+class TestModelsCache(unittest.IsolatedAsyncioTestCase):
+    """Test that the encoded model list is served from the cache,
+    until the model definitions are reloaded."""
+
+    def setUp(self) -> None:
+        self.stack = ExitStack()
+        self.stack.enter_context(patch.object(v1, "_models_cache", None))
+        self.stack.enter_context(patch.object(v1, "_model_data_cache", {}))
+        self.stack.enter_context(
+            patch.object(ModelDefinitions, "_refresh_modules", lambda: False)
+        )
+        self.stack.enter_context(
+            patch.object(
+                ModelDefinitions,
+                "_module_mappings",
+                ({"a": LlamaCppModel(model_path="a")}, {}),
+            )
+        )
+        self.collect_from_environs = self.stack.enter_context(
+            patch.object(
+                ModelDefinitions,
+                "_collect_from_environs",
+                return_value=({}, {}),
+            )
+        )
+        self.build_model_data = self.stack.enter_context(
+            patch.object(
+                v1, "_build_model_data", wraps=v1._build_model_data
+            )
+        )
+
+    def tearDown(self) -> None:
+        self.stack.close()
+
+    async def get_model_ids(self) -> List[str]:
+        response = await v1.get_models()
+        return [model["id"] for model in loads(response.body)["data"]]
+
+    async def test_cache_hit(self) -> None:
+        self.assertEqual(await self.get_model_ids(), ["a"])
+        self.assertEqual(await self.get_model_ids(), ["a"])
+        self.assertEqual(self.build_model_data.call_count, 1)
+
+    async def test_module_reloaded(self) -> None:
+        self.assertEqual(await self.get_model_ids(), ["a"])
+        # A reloaded module replaces the mappings collected from modules
+        ModelDefinitions._module_mappings = (
+            {"b": LlamaCppModel(model_path="b")},
+            {},
+        )
+        self.assertEqual(await self.get_model_ids(), ["b"])
+        self.assertEqual(self.build_model_data.call_count, 2)
+
+    async def test_environ_changed(self) -> None:
+        self.assertEqual(await self.get_model_ids(), ["a"])
+        self.collect_from_environs.return_value = (
+            {"c": LlamaCppModel(model_path="c")},
+            {},
+        )
+        self.assertEqual(await self.get_model_ids(), ["a", "c"])
+        self.assertEqual(await self.get_model_ids(), ["a", "c"])
+        self.assertEqual(self.build_model_data.call_count, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+import unittest
+from typing import List, Optional, Union
+
+from llama_api.mixins.prompt_utils import PromptUtilsMixin
+from llama_api.schemas.api import TextGenerationSettings
+
+
+class TestStopChecker(unittest.TestCase):
+    """Test the stop checker, which tells whether the text generated
+    so far contains a stop, may be followed by the rest of a stop,
+    or is good to be yielded."""
+
+    def build_checker(
+        self, stop: Optional[Union[str, List[str]]] = None
+    ) -> PromptUtilsMixin:
+        prompt_utils = PromptUtilsMixin()
+        prompt_utils.build_stops_from_settings(
+            TextGenerationSettings(stop=stop)
+        )
+        return prompt_utils
+
+    def test_exact_stop(self) -> None:
+        checker = self.build_checker(["\nUser:", "###"])
+        self.assertIs(checker.stop_checker("\nUser:"), True)
+        self.assertIs(checker.stop_checker("Bye!\nUser: Hi"), True)
+        self.assertIs(checker.stop_checker("###!"), True)
+
+    def test_partial_stop(self) -> None:
+        checker = self.build_checker(["\nUser:", "###"])
+        self.assertIs(checker.stop_checker("Bye!\n"), False)
+        self.assertIs(checker.stop_checker("Bye!\nUse"), False)
+        self.assertIs(checker.stop_checker("#"), False)
+        # A piece of a stop at the end is buffered in the first place
+        self.assertIs(checker.stop_checker("###"), False)
+        self.assertIs(checker.stop_checker("###\n"), False)
+        self.assertIsNone(checker.stop_checker("Bye!\nUsers"))
+        self.assertIsNone(checker.stop_checker("Bye!"))
+        self.assertIsNone(checker.stop_checker(""))
+
+    def test_single_stop(self) -> None:
+        checker = self.build_checker("</s>")
+        self.assertIs(checker.stop_checker("Bye</s>"), True)
+        self.assertIs(checker.stop_checker("Bye</"), False)
+        self.assertIsNone(checker.stop_checker("Bye"))
+
+    def test_no_stops(self) -> None:
+        for stop in (None, []):
+            checker = self.build_checker(stop)
+            self.assertIsNone(checker.stop_checker("Bye!\nUser:"))
+            self.assertIsNone(checker.stop_checker(""))
+        # Stops are not built yet
+        self.assertIsNone(PromptUtilsMixin().stop_checker("Bye!"))
+
+
+if __name__ == "__main__":
+    unittest.main()
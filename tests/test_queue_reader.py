@@ -0,0 +1,97 @@
+import unittest
+from queue import Queue
+from threading import Event
+from unittest.mock import patch
+
+from llama_api.server.routers.v1 import release_queue_reader
+from llama_api.utils import concurrency
+from llama_api.utils.concurrency import AsyncQueueReader, get_queue_and_event
+
+
+class BrokenQueue(Queue):
+    """A queue that fails like a proxy whose manager process is gone"""
+
+    def get(self, block=True, timeout=None):
+        raise ConnectionError("The manager process is gone")
+
+
+class TestAsyncQueueReader(unittest.IsolatedAsyncioTestCase):
+    """Test that the queue and event pairs are put back for reuse
+    only when their producer is done with them."""
+
+    wix: int = 0
+
+    def setUp(self) -> None:
+        self.idle_pairs = patch.dict(
+            concurrency._idle_queues_and_events, clear=True
+        )
+        self.idle_pairs.start()
+
+    def tearDown(self) -> None:
+        self.idle_pairs.stop()
+
+    def assert_reused(self, queue: Queue, event: Event) -> None:
+        event.set()  # The interrupt signal is set at the end of requests
+        self.assertEqual(get_queue_and_event(self.wix), (queue, event))
+        self.assertFalse(event.is_set())
+
+    def assert_not_reused(self) -> None:
+        self.assertFalse(
+            concurrency._idle_queues_and_events.get(self.wix)
+        )
+
+    async def test_producer_done(self) -> None:
+        """Test that the pair is reused after the producer puts None."""
+        queue, event = Queue(), Event()
+        reader = AsyncQueueReader(queue, poll_interval=0.01)
+        for item in ({"id": 1}, {"id": 2}, None):
+            queue.put(item)
+        items = [await reader.get() for _ in range(3)]
+        self.assertEqual(items, [{"id": 1}, {"id": 2}, None])
+        self.assertTrue(reader.is_finished)
+        release_queue_reader(self.wix, reader, event)
+        self.assert_reused(queue, event)
+
+    async def test_producer_raised(self) -> None:
+        """Test that the pair is reused after the producer
+        puts an exception, which is its last item."""
+        queue, event = Queue(), Event()
+        reader = AsyncQueueReader(queue, poll_interval=0.01)
+        queue.put(ValueError("The producer has failed"))
+        self.assertIsInstance(await reader.get(), ValueError)
+        self.assertTrue(reader.is_finished)
+        release_queue_reader(self.wix, reader, event)
+        self.assert_reused(queue, event)
+
+    async def test_queue_broken(self) -> None:
+        """Test that the pair is not reused if reading the queue fails."""
+        queue, event = BrokenQueue(), Event()
+        reader = AsyncQueueReader(queue, poll_interval=0.01)
+        self.assertIsInstance(await reader.get(), ConnectionError)
+        self.assertFalse(reader.is_finished)
+        release_queue_reader(self.wix, reader, event)
+        self.assert_not_reused()
+
+    async def test_closed_before_done(self) -> None:
+        """Test that the pair is not reused if the reader is closed
+        while the producer may still put items, e.g. on interruption."""
+        queue, event = Queue(), Event()
+        reader = AsyncQueueReader(queue, poll_interval=0.01)
+        queue.put({"id": 1})
+        self.assertEqual(await reader.get(), {"id": 1})
+        release_queue_reader(self.wix, reader, event)
+        self.assertFalse(reader.is_finished)
+        self.assert_not_reused()
+
+    async def test_never_started(self) -> None:
+        """Test that the pair is reused if nothing has used the queue,
+        e.g. for the requests to the reverse proxy."""
+        queue, event = Queue(), Event()
+        reader = AsyncQueueReader(queue, poll_interval=0.01)
+        release_queue_reader(self.wix, reader, event)
+        self.assertFalse(reader.is_started)
+        self.assert_reused(queue, event)
+
+
+if __name__ == "__main__":
+    unittest.main()
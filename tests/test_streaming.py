@@ -0,0 +1,164 @@
+import unittest
+from asyncio import Event as AsyncioEvent
+from asyncio import TimeoutError as AsyncioTimeoutError
+from asyncio import create_task, get_running_loop, sleep
+from queue import Queue
+from threading import Event
+from typing import Any, AsyncIterator, Dict, List
+from unittest.mock import MagicMock, patch
+
+from fastapi.responses import StreamingResponse
+from orjson import dumps
+
+from llama_api.schemas.api import APIChatMessage, CreateChatCompletionRequest
+from llama_api.server.routers import v1
+from llama_api.utils.concurrency import AsyncQueueReader
+from tests import conftest
+
+
+class Request:
+    """A request whose client never disconnects"""
+
+    async def receive(self) -> Dict[str, Any]:
+        return await get_running_loop().create_future()
+
+
+class Response:
+    """A streaming `httpx.Response` of the body chunks"""
+
+    def __init__(self, bodies: List[bytes]) -> None:
+        self.bodies = bodies
+
+    async def aiter_bytes(self) -> AsyncIterator[bytes]:
+        for body in self.bodies:
+            yield body
+
+
+def chunk(content: str) -> Dict[str, Any]:
+    return {
+        "id": "chatcmpl-test",
+        "object": "chat.completion.chunk",
+        "choices": [{"index": 0, "delta": {"content": content}}],
+    }
+
+
+def frames(*chunks: Dict[str, Any]) -> bytes:
+    return b"".join(b"data: " + dumps(chunk) + b"\n\n" for chunk in chunks)
+
+
+class TestEventPublisher(unittest.IsolatedAsyncioTestCase):
+    """Test the SSE stream of the chunks read from the queue,
+    which sends the chunks that have arrived together at once."""
+
+    async def asyncSetUp(self) -> None:
+        self.queue = Queue()  # type: Queue[Any]
+        self.event = Event()
+        self.reader = AsyncQueueReader(self.queue, poll_interval=0.01)
+        # The job is not run, and its chunks are put by the test
+        patcher = patch.object(v1, "run_in_processpool_with_wix")
+        patcher.start().side_effect = lambda func, wix: sleep(0)
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.reader.close)
+
+    async def get_response(self) -> StreamingResponse:
+        body = CreateChatCompletionRequest(
+            model="test", messages=[APIChatMessage(role="user", content="")]
+        )
+        ctx = (Request(), body, MagicMock(), 0, self.reader, self.event)
+        return await v1.get_chat_or_text_completion_streaming(ctx)
+
+    async def stream(self, response: StreamingResponse) -> List[bytes]:
+        """Send the response, and return its body chunks"""
+        bodies = []  # type: List[bytes]
+        sent = AsyncioEvent()
+
+        async def receive() -> Dict[str, Any]:
+            await sent.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message: Dict[str, Any]) -> None:
+            if message["type"] == "http.response.body":
+                if message.get("body"):
+                    bodies.append(message["body"])
+                if not message.get("more_body"):
+                    sent.set()
+
+        await response({"type": "http"}, receive, send)
+        return bodies
+
+    async def wait_for_items(self, count: int) -> None:
+        while len(self.reader._items) < count:
+            await sleep(0.01)
+
+    async def test_batched_frames(self) -> None:
+        """Test that the chunks that have already arrived are sent
+        in one body chunk, each of them framed as an event."""
+        chunks = [chunk("Hel"), chunk("lo"), chunk("!")]
+        self.queue.put(chunks[0])
+        response = await self.get_response()
+        for item in (*chunks[1:], None):
+            self.queue.put(item)
+        await self.wait_for_items(3)
+        bodies = await self.stream(response)
+        self.assertEqual(bodies, [frames(*chunks) + b"data: [DONE]\n\n"])
+        self.assertTrue(self.event.is_set())
+
+        # Several events in a body chunk, or an event split across them
+        data = bodies[0]
+        for size in (len(data), 7, 1):
+            split = [data[i : i + size] for i in range(0, len(data), size)]
+            parsed = [
+                json
+                async for json in (
+                    conftest.TestLlamaAPI.extract_json_from_streaming_response(
+                        Response(split)  # type: ignore
+                    )
+                )
+            ]
+            self.assertEqual(parsed, chunks)
+
+    async def test_waits_for_next_chunk(self) -> None:
+        """Test that the stream waits for the chunks yet to come."""
+        chunks = [chunk("Hel"), chunk("lo")]
+        self.queue.put(chunks[0])
+        response = await self.get_response()
+
+        async def produce() -> None:
+            await sleep(0.05)
+            self.queue.put(chunks[1])
+            self.queue.put(None)
+
+        producer = create_task(produce())
+        bodies = await self.stream(response)
+        await producer
+        self.assertEqual(bodies[0], frames(chunks[0]))
+        self.assertEqual(
+            b"".join(bodies), frames(*chunks) + b"data: [DONE]\n\n"
+        )
+
+    async def test_timeout(self) -> None:
+        """Test that the stream stops if no chunk arrives in time,
+        and that the producer is interrupted."""
+        self.queue.put(chunk("Hel"))
+        with patch.object(v1, "LOOP_TIMEOUT", 0.05):
+            response = await self.get_response()
+            body_iterator = response.body_iterator.__aiter__()
+            self.assertEqual(
+                await body_iterator.__anext__(), frames(chunk("Hel"))
+            )
+            with self.assertRaises(AsyncioTimeoutError):
+                await body_iterator.__anext__()
+        self.assertTrue(self.event.is_set())
+
+    async def test_reader_timeout(self) -> None:
+        """Test that the reader can wait for an item again
+        after the previous wait has timed out."""
+        with self.assertRaises(AsyncioTimeoutError):
+            await self.reader.get(timeout=0.01)
+        self.queue.put(chunk("Hel"))
+        self.assertEqual(await self.reader.get(timeout=1.0), chunk("Hel"))
+        self.assertIsNone(self.reader._waiter)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,183 @@
+import unittest
+from asyncio import CancelledError, create_task, sleep
+from collections import deque
+from contextlib import ExitStack
+from unittest.mock import patch
+
+from llama_api.server.routers import v1
+from llama_api.server.routers.v1 import WixHandler
+
+
+class TestWixHandler(unittest.IsolatedAsyncioTestCase):
+    """Test the admission of requests to the workers."""
+
+    def setUp(self) -> None:
+        # Three workers with a single slot each, with fresh metadata
+        self.stack = ExitStack()
+        self.stack.enter_context(patch.object(v1, "MAX_SEMAPHORES", 1))
+        for name, value in (
+            ("processed_keys", [None, None, None]),
+            ("in_flight", [0, 0, 0]),
+            ("ewma_latencies", [0.0, 0.0, 0.0]),
+            ("_waiters", [deque(), deque(), deque()]),
+            ("_key_to_wix", {}),
+        ):
+            self.stack.enter_context(patch.object(WixHandler, name, value))
+
+    def tearDown(self) -> None:
+        self.stack.close()
+
+    async def test_hand_off_in_arrival_order(self) -> None:
+        """Test that a released slot is handed over to the oldest waiter,
+        and that a new request can't take it ahead of the waiters."""
+        order = []
+
+        async def request(name: str) -> None:
+            await WixHandler.acquire(0)
+            order.append(name)
+
+        await WixHandler.acquire(0)
+        tasks = [create_task(request(name)) for name in ("a", "b")]
+        await sleep(0)  # Let both of them wait for the slot
+        WixHandler.release(0)
+        # The slot is already handed over, so the new request must wait
+        late = create_task(request("c"))
+        await sleep(0)
+        self.assertEqual(order, ["a"])
+        WixHandler.release(0)
+        await sleep(0)
+        WixHandler.release(0)
+        await tasks[1]
+        await late
+        self.assertEqual(order, ["a", "b", "c"])
+        WixHandler.release(0)
+        self.assertEqual(WixHandler.in_flight[0], 0)
+        self.assertFalse(WixHandler._waiters[0])
+
+    async def test_cancelled_waiter(self) -> None:
+        """Test that a cancelled waiter gives up its place, even if
+        the slot is released in the same tick as the cancellation."""
+        await WixHandler.acquire(0)
+        task = create_task(WixHandler.acquire(0))
+        await sleep(0)
+        task.cancel()
+        WixHandler.release(0)  # Skips the cancelled waiter
+        with self.assertRaises(CancelledError):
+            await task
+        self.assertEqual(WixHandler.in_flight[0], 0)
+        self.assertFalse(WixHandler._waiters[0])
+
+    async def test_cancelled_waiter_skipped(self) -> None:
+        """Test that the hand-off skips a cancelled waiter,
+        and gives the slot to the waiter behind it."""
+        await WixHandler.acquire(0)
+        first = create_task(WixHandler.acquire(0))
+        second = create_task(WixHandler.acquire(0))
+        await sleep(0)
+        first.cancel()
+        WixHandler.release(0)
+        with self.assertRaises(CancelledError):
+            await first
+        await second
+        self.assertEqual(WixHandler.in_flight[0], 1)
+        self.assertFalse(WixHandler._waiters[0])
+        WixHandler.release(0)
+        self.assertEqual(WixHandler.in_flight[0], 0)
+
+    async def test_cancelled_after_hand_off(self) -> None:
+        """Test that a waiter cancelled after the hand-off
+        passes the slot on to the next waiter."""
+        await WixHandler.acquire(0)
+        first = create_task(WixHandler.acquire(0))
+        second = create_task(WixHandler.acquire(0))
+        await sleep(0)
+        WixHandler.release(0)  # Hands the slot over to the first waiter
+        first.cancel()
+        with self.assertRaises(CancelledError):
+            await first
+        await second
+        self.assertEqual(WixHandler.in_flight[0], 1)
+        self.assertFalse(WixHandler._waiters[0])
+
+    async def test_get_wix(self) -> None:
+        """Test that the worker of the same model is preferred, then an
+        idle worker, and then the worker with the fewest slots in use."""
+        WixHandler.processed_keys[:2] = ["b", "c"]
+        await WixHandler.acquire(0)
+        self.assertEqual(WixHandler.get_wix("a"), 2)
+        WixHandler.processed_keys[2] = "a"
+        self.assertEqual(WixHandler.get_wix("a"), 2)
+        # The workers 1 and 2 are tied, and chosen at random
+        chosen = {WixHandler.get_wix("d") for _ in range(200)}
+        self.assertEqual(chosen, {1, 2})
+        WixHandler.release(0)
+
+    async def test_get_wix_prefers_less_loaded_worker(self) -> None:
+        """Test that a busy worker of the same model doesn't win
+        over an idle worker of the same model, whatever its latency."""
+        WixHandler.processed_keys[:2] = ["a", "a"]
+        WixHandler.ewma_latencies[:2] = [0.0, 10.0]
+        await WixHandler.acquire(0)
+        waiters = [create_task(WixHandler.acquire(0)) for _ in range(5)]
+        await sleep(0)
+        try:
+            for _ in range(200):
+                self.assertEqual(WixHandler.get_wix("a"), 1)
+        finally:
+            for waiter in waiters:
+                waiter.cancel()
+            await sleep(0)
+
+    async def test_get_wix_prefers_lower_latency(self) -> None:
+        """Test that the workers of the same rank and load are ordered
+        by the average duration of their requests."""
+        WixHandler.processed_keys[:] = ["a", "b", "c"]
+        for wix, duration in ((0, 4.0), (1, 1.0), (2, 6.0)):
+            await WixHandler.acquire(wix)
+            WixHandler.release(wix, duration)
+        self.assertEqual(WixHandler.ewma_latencies, [2.0, 0.5, 3.0])
+        for _ in range(200):
+            self.assertEqual(WixHandler.get_wix("d"), 1)
+        # A slow request moves the average towards its duration
+        await WixHandler.acquire(1)
+        WixHandler.release(1, 6.5)
+        self.assertEqual(WixHandler.ewma_latencies[1], 3.5)
+        self.assertEqual(WixHandler.get_wix("d"), 0)
+
+    async def test_get_wix_fast_path(self) -> None:
+        """Test that the last worker assigned to the key is chosen
+        without ranking the workers while it has a free slot."""
+        self.stack.enter_context(patch.object(v1, "MAX_SEMAPHORES", 2))
+        WixHandler.set_processed_key(0, "a")
+        WixHandler.set_processed_key(1, "a")
+        await WixHandler.acquire(1)
+        # Ranking would choose the idle worker 0 of the same model
+        self.assertEqual(WixHandler.get_wix("a"), 1)
+        await WixHandler.acquire(1)
+        self.assertEqual(WixHandler.get_wix("a"), 0)
+        WixHandler.release(1)
+        WixHandler.release(1)
+
+    async def test_get_wix_after_key_moves(self) -> None:
+        """Test that the key follows the worker it's assigned to last,
+        and that a stale entry falls through to ranking the workers."""
+        WixHandler.set_processed_key(0, "a")
+        WixHandler.set_processed_key(1, "a")
+        self.assertEqual(WixHandler._key_to_wix["a"], 1)
+        self.assertEqual(WixHandler.get_wix("a"), 1)
+        # The worker 1 switches to another model, and the entry is stale
+        WixHandler.set_processed_key(1, "b")
+        self.assertEqual(WixHandler._key_to_wix["a"], 1)
+        self.assertEqual(WixHandler.get_wix("a"), 0)
+        # No worker holds the model, so the least loaded one is chosen
+        WixHandler.set_processed_key(0, "c")
+        WixHandler.set_processed_key(2, "d")
+        await WixHandler.acquire(1)
+        await WixHandler.acquire(2)
+        self.assertEqual(WixHandler.get_wix("a"), 0)
+        WixHandler.release(1)
+        WixHandler.release(2)
+
+
+if __name__ == "__main__":
+    unittest.main()